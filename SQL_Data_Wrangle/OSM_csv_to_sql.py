@@ -8,6 +8,7 @@ import sqlite3
 import psycopg2
 import csv
 import re
+import os
 # import config
 
 OSM_PATH = "idaho_sw.xml"
@@ -16,6 +17,7 @@ NODE_TAGS_PATH = "nodes_tags.csv"
 WAYS_PATH = "ways.csv"
 WAY_NODES_PATH = "ways_nodes.csv"
 WAY_TAGS_PATH = "ways_tags.csv"
+WAY_GEOMETRY_PATH = "ways_geometry.csv"
 
 letter = re.compile(r'[a-z]', re.IGNORECASE)
 string = re.compile(r'[^0-9\.\-]')
@@ -83,6 +85,16 @@ CREATE TABLE ways_nodes (
 );
 """
 
+ways_geometry_cmd = """
+CREATE TABLE ways_geometry (
+    id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    lat REAL,
+    lon REAL,
+    FOREIGN KEY (id) REFERENCES ways(id)
+);
+"""
+
 
 def establish_connection(db_name="osm_idaho.db"):
     # SQLite Implemenation
@@ -98,6 +110,7 @@ def initialize_tables(cur):
     cur.execute("DROP TABLE IF EXISTS Ways")
     cur.execute("DROP TABLE IF EXISTS Ways_Tags")
     cur.execute("DROP TABLE IF EXISTS Ways_Nodes")
+    cur.execute("DROP TABLE IF EXISTS Ways_Geometry")
 
     # Add fresh tables
     cur.execute(nodes_cmd)
@@ -105,6 +118,7 @@ def initialize_tables(cur):
     cur.execute(ways_cmd)
     cur.execute(ways_tags_cmd)
     cur.execute(ways_nodes_cmd)
+    cur.execute(ways_geometry_cmd)
 
 
 def fill_table(source, table_name, cur):
@@ -132,6 +146,14 @@ def fill_table(source, table_name, cur):
                 err.append(cmd)
 
 
+def fill_geometry_table(source, cur):
+    # Coordinates are plain numbers, so skip fill_table's text cleaning
+    # (which strips decimal points) and insert them as parameters
+    next(source)
+    cur.executemany("INSERT INTO Ways_Geometry(id,position,lat,lon) VALUES(?,?,?,?);",
+                    source)
+
+
 if __name__ == "__main__":
     print('Beginning CSV -> SQL Conversion...')
 
@@ -153,4 +175,9 @@ if __name__ == "__main__":
         fill_table(way_tag_f, "Ways_Tags", cur)
         fill_table(way_nodes_f, "Ways_Nodes", cur)
 
+    # Only written by OSM_xml_to_csv.py when a node index is enabled
+    if os.path.exists(WAY_GEOMETRY_PATH):
+        with open(WAY_GEOMETRY_PATH, 'r') as way_geometry_file:
+            fill_geometry_table(csv.reader(way_geometry_file), cur)
+
     print('Finished!')
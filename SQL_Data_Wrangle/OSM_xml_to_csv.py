@@ -9,7 +9,9 @@ import xml.etree.cElementTree as ET   # XML Processing
 import re                             # Regular Expressions
 import csv                            # CSV Handler
 import codecs                         # File Opener
+from contextlib import ExitStack      # Optional Output Files
 import street_cleaning as cl
+from node_index import NodeIndex      # Node Coordinate Lookup
 
 
 # Set path names
@@ -19,6 +21,11 @@ NODE_TAGS_PATH = "nodes_tags.csv"
 WAYS_PATH = "ways.csv"
 WAY_NODES_PATH = "ways_nodes.csv"
 WAY_TAGS_PATH = "ways_tags.csv"
+WAY_GEOMETRY_PATH = "ways_geometry.csv"
+
+# Node index for resolving way geometries: None (off), ':memory:',
+# or a file path for extracts larger than RAM
+NODE_INDEX_PATH = None
 
 # Regex
 lower_colon = re.compile(r'^([a-z]|_)+:([a-z]|_)+')
@@ -30,6 +37,7 @@ NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
 WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_NODES_FIELDS = ['id', 'node_id', 'position']
+WAY_GEOMETRY_FIELDS = ['id', 'position', 'lat', 'lon']
 
 """
 Clean and shape node or way XML element to Python dict
@@ -38,10 +46,12 @@ element: XML element.
 node_attr: Schema of fields for node element.
 way_attr_fields: Schema of fields for way element.
 problem_chars: A regex for finding problem characters.
+node_index: Optional NodeIndex. Nodes are added to it, and ways are
+            resolved against it into a 'way_geometry' list of (lat, lon).
 returns: A dictionary with formatted data relevant to the element type.
 """
 def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIELDS,
-                  problem_chars=problemchars):
+                  problem_chars=problemchars, node_index=None):
     node_attribs = dict()
     way_attribs = dict()
     way_nodes = []
@@ -51,6 +61,8 @@ def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIE
             node_attribs[field] = element.attrib[field]
 
         node_id = node_attribs['id']
+        if node_index is not None:
+            node_index.add(node_id, node_attribs['lat'], node_attribs['lon'])
         tag_iterator = element.iter("tag")
         tags = process_tags(tag_iterator, node_id)
         return {'node': node_attribs, 'node_tags': tags}
@@ -71,7 +83,11 @@ def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIE
 
         tag_iterator = element.iter("tag")
         tags = process_tags(tag_iterator, way_id)
-        return {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
+        shaped = {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
+        if node_index is not None:
+            shaped['way_geometry'] = node_index.resolve(
+                nd['node_id'] for nd in way_nodes)
+        return shaped
 
 
 # ================================================== #
@@ -123,6 +139,20 @@ def process_tags(tag_iterator, node_id, default_tag_type='regular'):
     return tags
 
 
+"""
+Write a shaped way's resolved coordinates, one row per node.
+
+writer: A csv.DictWriter with WAY_GEOMETRY_FIELDS.
+el: A shaped way, as returned by shape_element with a node_index.
+"""
+def write_geometry(writer, el):
+    way_id = el['way']['id']
+    for nd, coords in zip(el['way_nodes'], el['way_geometry']):
+        if coords is not None:
+            writer.writerow({'id': way_id, 'position': nd['position'],
+                             'lat': coords[0], 'lon': coords[1]})
+
+
 # ================================================== #
 #               Main Function                        #
 # ================================================== #
@@ -130,13 +160,17 @@ def process_tags(tag_iterator, node_id, default_tag_type='regular'):
 Iteratively process each XML element and write to csv(s).
 
 file_in: The input filename.
+node_index: Optional NodeIndex. If given, each way's nodes are resolved
+            to coordinates in the same pass and written to
+            WAY_GEOMETRY_PATH; nodes missing from the extract are skipped.
 """
-def process_map(file_in):
+def process_map(file_in, node_index=None):
     with codecs.open(NODES_PATH, 'w') as nodes_file, \
             codecs.open(NODE_TAGS_PATH, 'w') as nodes_tags_file, \
             codecs.open(WAYS_PATH, 'w') as ways_file, \
             codecs.open(WAY_NODES_PATH, 'w') as way_nodes_file, \
-            codecs.open(WAY_TAGS_PATH, 'w') as way_tags_file:
+            codecs.open(WAY_TAGS_PATH, 'w') as way_tags_file, \
+            ExitStack() as optional_files:
 
         nodes_writer = csv.DictWriter(nodes_file, NODE_FIELDS)
         node_tags_writer = csv.DictWriter(nodes_tags_file, NODE_TAGS_FIELDS)
@@ -150,8 +184,14 @@ def process_map(file_in):
         way_nodes_writer.writeheader()
         way_tags_writer.writeheader()
 
+        if node_index is not None:
+            geometry_file = optional_files.enter_context(
+                codecs.open(WAY_GEOMETRY_PATH, 'w'))
+            geometry_writer = csv.DictWriter(geometry_file, WAY_GEOMETRY_FIELDS)
+            geometry_writer.writeheader()
+
         for element in get_element(file_in, tags=('node', 'way')):
-            el = shape_element(element)
+            el = shape_element(element, node_index=node_index)
             if el:
                 if element.tag == 'node':
                     nodes_writer.writerow(el['node'])
@@ -160,11 +200,18 @@ def process_map(file_in):
                     ways_writer.writerow(el['way'])
                     way_nodes_writer.writerows(el['way_nodes'])
                     way_tags_writer.writerows(el['way_tags'])
+                    if node_index is not None:
+                        write_geometry(geometry_writer, el)
 
 
 if __name__ == "__main__":
     print('Beginning XML -> CSV Conversion...')
-    process_map(OSM_PATH)
+    if NODE_INDEX_PATH is None:
+        process_map(OSM_PATH)
+    else:
+        index_path = None if NODE_INDEX_PATH == ':memory:' else NODE_INDEX_PATH
+        with NodeIndex(index_path, remove_on_close=True) as node_index:
+            process_map(OSM_PATH, node_index=node_index)
     print('Finished!')
 
 
@@ -0,0 +1,289 @@
+"""
+node_index.py
+
+A compact node id -> coordinate index, filled while streaming an
+OpenStreetMap XML file so that ways can be resolved to geometries
+in the same pass.
+"""
+
+from array import array               # Compact Typed Arrays
+from bisect import bisect_left        # Binary Search
+import mmap                           # Memory-Mapped Files
+import os                             # File Removal
+import struct                         # Binary Records
+
+
+# Coordinates are stored as fixed-point integers (1e-7 degrees), the
+# same precision OSM itself uses.
+COORD_SCALE = 10 ** 7
+
+# On-disk record: node id, lat, lon (16 bytes per node)
+RECORD = struct.Struct('<qii')
+
+
+"""
+Convert a coordinate string (or float) into a fixed-point integer.
+
+value: A latitude or longitude.
+returns: An integer in units of 1e-7 degrees.
+"""
+def to_fixed(value):
+    return int(round(float(value) * COORD_SCALE))
+
+
+"""
+Stores node coordinates in sorted, array-backed columns.
+
+Nodes in an OSM extract are written in ascending id order, so adding
+them is an append. In memory mode, ids may arrive in any order until
+the first lookup, which sorts the columns once; sorting temporarily
+needs roughly 25 bytes per node on top of the index itself. If an id
+was added more than once by then, the last coordinates added win.
+After the first lookup, and always in file mode, ids must be strictly
+ascending and anything else raises ValueError. JOSM exports, whose new
+nodes have descending negative ids, therefore need memory mode.
+
+path: Optional filename. If given, records are written to this file
+      and looked up through a memory map, for extracts larger than RAM.
+      The file is overwritten on open and belongs to the caller, who
+      must delete it once done, unless remove_on_close is set.
+remove_on_close: If True, close() deletes the file at path.
+"""
+class NodeIndex(object):
+    def __init__(self, path=None, remove_on_close=False):
+        self.path = path
+        self.remove_on_close = remove_on_close
+        self.is_sorted = True
+        self.has_lookups = False
+        self.max_id = None
+        self.count = 0
+        self.map = None
+        if path is None:
+            self.ids = array('q')
+            self.lats = array('i')
+            self.lons = array('i')
+            self.file = None
+        else:
+            self.file = open(path, 'w+b')
+
+    def __len__(self):
+        return self.count
+
+    """
+    Add a node to the index.
+
+    node_id: The node's id.
+    lat: The node's latitude.
+    lon: The node's longitude.
+    """
+    def add(self, node_id, lat, lon):
+        node_id = int(node_id)
+        if self.max_id is not None and node_id <= self.max_id:
+            if self.file is not None or self.has_lookups:
+                raise ValueError("Node ids must be ascending in file mode or "
+                                 "after the first lookup (got %d after %d)"
+                                 % (node_id, self.max_id))
+            self.is_sorted = False
+        else:
+            self.max_id = node_id
+        self.count += 1
+
+        if self.file is None:
+            self.ids.append(node_id)
+            self.lats.append(to_fixed(lat))
+            self.lons.append(to_fixed(lon))
+        else:
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+            self.file.write(RECORD.pack(node_id, to_fixed(lat), to_fixed(lon)))
+
+    """
+    Find the coordinates of a node.
+
+    node_id: The node's id.
+    returns: A (lat, lon) tuple of floats, or None if the node is missing
+             (e.g. a way that crosses the edge of the extract).
+    """
+    def lookup(self, node_id):
+        node_id = int(node_id)
+        self.has_lookups = True
+        if self.file is None:
+            return self._lookup_array(node_id)
+        return self._lookup_map(node_id)
+
+    """
+    Resolve a list of node ids to coordinates.
+
+    node_ids: An iterable of node ids.
+    returns: A list of (lat, lon) tuples, with None for missing nodes.
+    """
+    def resolve(self, node_ids):
+        return [self.lookup(node_id) for node_id in node_ids]
+
+    """
+    Release the memory map and file handle, if any, and delete the
+    backing file if remove_on_close was set.
+    """
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            if self.remove_on_close:
+                os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _lookup_array(self, node_id):
+        if not self.is_sorted:
+            self._sort_arrays()
+        i = bisect_left(self.ids, node_id)
+        if i < len(self.ids) and self.ids[i] == node_id:
+            return (float(self.lats[i]) / COORD_SCALE,
+                    float(self.lons[i]) / COORD_SCALE)
+        return None
+
+    # Stable natural merge sort of a permutation held in two 'q' arrays,
+    # so no per-node Python objects are created. Already-ascending runs
+    # are kept as they are, which makes merged extracts cheap to sort.
+    # The columns are then rebuilt one at a time, dropping all but the
+    # last-added copy of each duplicate id.
+    def _sort_arrays(self):
+        ids = self.ids
+        n = len(ids)
+        order = array('q', range(n))
+        buf = array('q', [0]) * n
+        runs = array('q', [0])
+        for i in range(1, n):
+            if ids[i] < ids[i - 1]:
+                runs.append(i)
+        runs.append(n)
+
+        while len(runs) > 2:
+            merged = array('q', [0])
+            for k in range(0, len(runs) - 1, 2):
+                lo, mid = runs[k], runs[k + 1]
+                hi = runs[k + 2] if k + 2 < len(runs) else mid
+                i, j, out = lo, mid, lo
+                while i < mid and j < hi:
+                    if ids[order[j]] < ids[order[i]]:
+                        buf[out] = order[j]
+                        j += 1
+                    else:
+                        buf[out] = order[i]
+                        i += 1
+                    out += 1
+                buf[out:out + mid - i] = order[i:mid]
+                out += mid - i
+                buf[out:hi] = order[j:hi]
+                merged.append(hi)
+            order, buf = buf, order
+            runs = merged
+        del buf
+
+        keep = lambda p: p == n - 1 or ids[order[p]] != ids[order[p + 1]]
+        for name, typecode in (('lats', 'i'), ('lons', 'i'), ('ids', 'q')):
+            column = getattr(self, name)
+            setattr(self, name, None)
+            setattr(self, name, array(typecode,
+                                      (column[order[p]] for p in range(n) if keep(p))))
+            del column
+        self.count = len(self.ids)
+        self.is_sorted = True
+
+    def _lookup_map(self, node_id):
+        if self.count == 0:
+            return None
+        if self.map is None:
+            self.file.flush()
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_id, lat, lon = RECORD.unpack_from(self.map, mid * RECORD.size)
+            if mid_id < node_id:
+                lo = mid + 1
+            elif mid_id > node_id:
+                hi = mid
+            else:
+                return (float(lat) / COORD_SCALE, float(lon) / COORD_SCALE)
+        return None
+
+
+# ================================================== #
+#               Self-Check                           #
+# ================================================== #
+"""
+Exercise both storage modes against known inputs.
+"""
+def self_check():
+    import tempfile
+
+    # Memory mode, out-of-order and duplicate ids, adds after a lookup
+    index = NodeIndex()
+    index.add('5', '43.6072000', '-116.3651000')
+    index.add('3', '0', '0')
+    index.add('-2', '10', '20')
+    index.add('4', '-0.0000001', '179.9999999')
+    index.add('3', '43.1234567', '-116.0000001')
+    assert index.lookup(3) == (43.1234567, -116.0000001)
+    assert index.lookup(4) == (-0.0000001, 179.9999999)
+    assert index.lookup(-2) == (10.0, 20.0)
+    assert len(index) == 4
+    for node_id in (4, 5):
+        try:
+            index.add(node_id, 0, 0)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("Out-of-order id accepted after a lookup")
+    index.add('6', '1', '2')
+    assert index.resolve(['3', '4', '5', '6']) == [
+        (43.1234567, -116.0000001), (-0.0000001, 179.9999999),
+        (43.6072, -116.3651), (1.0, 2.0)]
+    assert index.lookup(7) is None
+    assert index.lookup(0) is None
+    assert len(index) == 5
+
+    # Memory mode, shuffled ids sorted in one pass
+    index = NodeIndex()
+    node_ids = [(i * 7919) % 1009 for i in range(1009)]
+    for node_id in node_ids:
+        index.add(node_id, node_id / 1000.0, 0)
+    assert index.resolve(range(1009)) == [(i / 1000.0, 0.0) for i in range(1009)]
+    assert list(index.ids) == sorted(node_ids)
+
+    # File mode, missing ids, adds after a lookup, ordering enforced
+    handle, path = tempfile.mkstemp(suffix='.nodes')
+    os.close(handle)
+    with NodeIndex(path, remove_on_close=True) as index:
+        assert index.lookup(1) is None
+        for node_id in range(1, 1000, 2):
+            index.add(node_id, node_id / 1000.0, -node_id / 1000.0)
+        assert index.lookup(501) == (0.501, -0.501)
+        assert index.lookup(1) == (0.001, -0.001)
+        assert index.lookup(999) == (0.999, -0.999)
+        assert index.lookup(500) is None
+        index.add(1001, '-89.9999999', '-179.9999999')
+        assert index.lookup(1001) == (-89.9999999, -179.9999999)
+        try:
+            index.add(3, 0, 0)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("Out-of-order id accepted in file mode")
+    assert not os.path.exists(path)
+
+
+if __name__ == "__main__":
+    print('Running NodeIndex self-check...')
+    self_check()
+    print('Finished!')